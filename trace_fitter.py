@@ -26,6 +26,42 @@
 #	      np.array(), rather than as tuple, append computed values for
 #	      reporting or multi-event averaging.
 # 20241212  Convert most functionality to class, to better share settings.
+# 20260901  Add analytic Jacobians for TES and FET shapes, pass to curve_fit
+#	      to avoid finite-difference evaluations of the pulse shape.
+# 20260901  Call least_squares(method='lm') directly instead of curve_fit;
+#	      x_scale='jac' handles the disparate parameter magnitudes.
+# 20260901  Use searchsorted on running max/min for threshold searches in
+#	      guessTES and guessFET, replacing np.nonzero masks.
+# 20260901  Use argmax to locate trace peak in fittingRange, instead of
+#	      converting the whole trace to a Python list.
+# 20260901  Compute fittingRange once per fit and pass it through to the
+#	      solver and plots; evaluate fitted shape only on the fit slice.
+# 20260901  Vectorize array evaluation of _TESshape/_FETshape; use numexpr
+#	      for a single fused pass when it is available.
+# 20260901  Add optional Numba kernels computing residuals and Jacobian
+#	      in a single compiled pass; fall back to numpy shapes.
+# 20260901  Scan for trace peak once per fit; pass peak and ipeak through
+#	      to guess functions and fittingRange.
+# 20260901  Remove guessRange and the dobounds argument; LM is always
+#	      unconstrained.
+# 20260901  Cache parsed templates at module level for batch processing.
+# 20260901  Add batch mode: -e/-c accept ranges and lists, processed by
+#	      new fitMany() within a single job.
+# 20260901  Add -j option to run batch fits in parallel worker processes.
+# 20260901  Add -f option for plot formats (default png only); rasterize
+#	      trace lines and close figures after saving.
+# 20260901  Reuse one overlay figure per sensor type across batch plots.
+# 20260901  Take scale guess directly from trace peak (TESshape is
+#	      peak-normalized); use exact analytic peak time for offset.
+# 20260901  Cast bins and trace to float32 before fitting.
+# 20260901  Replace np.nonzero index lookups in fittingRange with argmax
+#	      based _firstTrue/_lastTrue helpers.
+# 20260901  Import matplotlib and scipy.optimize lazily, inside the
+#	      functions that need them.
+# 20260901  Hoist bin/trace scans and constant dicts out of overlay's
+#	      per-panel loop.
+# 20260901  Prefer AOT-compiled kernels from _trace_kernels.pyx when the
+#	      extension has been built.
 
 def usage():
     print("""
@@ -38,7 +74,15 @@ Argument: <file>    DMC ROOT file from single-detector simulation
 Options: -d <det>   Detector type name (iZIP5, NF-C, etc.)
          -e <event> Event number from file to be processed (-1 does average)
          -c <chan>  Index (0 to N-1) of channel to be processed (-1 iterates)
+
+         Both -e and -c also accept inclusive ranges ("0-99") and comma
+         lists ("0,1,3"), which are processed in a single job, avoiding
+         per-fit startup costs (imports, ROOT file open).
+
          -s <type>  Sensor type (TES or FET)
+         -j <njobs> Number of parallel processes for batch fits (-1 uses
+                    all cores; results may be reported out of order)
+         -f <fmts>  Comma-separated plot formats ("png,eps"); default png
          -h         [Optional] Display this usage information
          -p         [Optional] Generate plots of fit results
          -v         [Optional] Verbose output
@@ -52,17 +96,113 @@ Requires: Numpy, Matplotlib, SciPy, ROOT""")
 
 ### CONFIGURATION ###
 
+# NOTE: matplotlib and scipy.optimize are imported lazily, inside the
+# functions that use them; a plotless batch job never pays the ~300ms
+# matplotlib startup, and -h/usage costs almost nothing.
 from traceReader import *
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+from functools import lru_cache
 import os, sys
 
+try:			# Optional: fuses elementwise shape evaluation
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:			# Optional: JIT-compiled residual/Jacobian kernels
+    import numba
+except ImportError:
+    numba = None
+
+try:			# Optional: prebuilt kernels, see _trace_kernels.pyx
+    import _trace_kernels
+except ImportError:
+    _trace_kernels = None
+
+
+### JIT-COMPILED FITTING KERNELS (used by traceFitter.fitTrace) ###
+
+if numba:
+    @numba.njit(cache=True, fastmath=True)
+    def _TESresidJac(x, y, a, t_r, t_f, offset):
+        """Residuals and Jacobian of TESshape vs. trace y, in one fused
+           pass.  Same math as TESshape/TESjacobian; see those for the
+           normalization and envelope-theorem terms."""
+        tpeak = np.log(t_f/t_r) * t_f*t_r / (t_f-t_r)
+        epf = np.exp(-tpeak/t_f)
+        epr = np.exp(-tpeak/t_r)
+        peak = epf - epr
+
+        n = x.shape[0]
+        resid = np.empty(n)
+        jac = np.zeros((n,4))
+        for i in range(n):
+            t = x[i] - offset
+            if t < 0.:			# Shape is zero before t0
+                resid[i] = -y[i]
+                continue
+            ef = np.exp(-t/t_f)
+            er = np.exp(-t/t_r)
+            shape = ef - er
+            resid[i] = (a/peak)*shape - y[i]
+            jac[i,0] = shape/peak
+            jac[i,1] = -(a/(peak*t_r**2)) * (er*t - shape*epr*tpeak/peak)
+            jac[i,2] =  (a/(peak*t_f**2)) * (ef*t - shape*epf*tpeak/peak)
+            jac[i,3] =  (a/peak) * (ef/t_f - er/t_r)
+
+        return resid, jac
+
+    @numba.njit(cache=True, fastmath=True)
+    def _FETresidJac(x, y, a, invTd, invTr, offset):
+        """Residuals and Jacobian of FETshape vs. trace y, in one fused
+           pass.  Same math as FETshape/FETjacobian."""
+        peak = invTr**2 - invTd**2
+
+        n = x.shape[0]
+        resid = np.empty(n)
+        jac = np.zeros((n,4))
+        for i in range(n):
+            t = x[i] - offset
+            if t < 0.:			# Shape is zero before t0
+                resid[i] = -y[i]
+                continue
+            ed = np.exp(-t*invTd)
+            er = np.exp(-t*invTr)
+            shape = ed*invTd - er*invTr
+            resid[i] = (a/peak)*shape - y[i]
+            jac[i,0] = shape/peak
+            jac[i,1] =  (a/peak)*ed*(1.-t*invTd) + (2.*a*invTd/peak**2)*shape
+            jac[i,2] = -(a/peak)*er*(1.-t*invTr) - (2.*a*invTr/peak**2)*shape
+            jac[i,3] =  (a/peak) * (invTd**2*ed - invTr**2*er)
+
+        return resid, jac
+else:
+    _TESresidJac = None
+    _FETresidJac = None
+
+if _trace_kernels:	# Prefer AOT-compiled kernels: same math, no JIT warmup
+    _TESresidJac = _trace_kernels.tes_resid_jac
+    _FETresidJac = _trace_kernels.fet_resid_jac
+
 global CDMS_SUPERSIM
 CDMS_SUPERSIM = os.environ['CDMS_SUPERSIM']
 
 
+### BOOLEAN MASK SEARCH HELPERS ###
+
+def _firstTrue(mask):
+    """Index of first True element of boolean mask, or -1 if none.  argmax
+       short-circuits at the first True and allocates no index array,
+       unlike np.nonzero(mask)[0][0]."""
+    return int(mask.argmax()) if mask.any() else -1
+
+def _lastTrue(mask):
+    """Index of last True element of boolean mask, or -1 if none."""
+    rev = mask[::-1]
+    return len(mask)-1 - int(rev.argmax()) if rev.any() else -1
+
+
 ### DRIVER CLASS TO PERFORM FITS ###
 
 class traceFitter:
@@ -88,6 +228,7 @@ class traceFitter:
         self.reader  = traceReader(file, verbose)
         self.sensor  = sensor
         self.verbose = verbose
+        self.formats = ["png"]		# Plot formats, see setFormats()
 
         return
 
@@ -96,6 +237,14 @@ class traceFitter:
     def setVerbose(self, verbose=True):
         self.verbose = verbose
 
+    def setFormats(self, formats):
+        """Set list of plot file formats ('png', 'eps', etc.); accepts a
+           list or a comma-separated string.  EPS output through the PS
+           backend is much slower than PNG for dense traces, so it is no
+           longer written by default."""
+        if isinstance(formats, str): formats = formats.split(',')
+        self.formats = list(formats)
+
     def printVerbose(self, string):
         if self.verbose: print(string)
 
@@ -104,16 +253,23 @@ class traceFitter:
 
     # Main fitting functions
 
-    def doFit(self, detname="", event=0, channel=0, doplot=False):
+    def doFit(self, detname="", event=0, channel=0, doplot=False, njobs=1):
         """Get specified TES or FET trace (event and channel) from DMC file,
            fit for shape and make overlay plots if requested.
 
            Arguments: detname	Detector name string used for output.
                       event	Event to process; -1 averages all events.
                       channel	Channel index; -1 iterates all channels.
-                      doplot	True to generate overlay of trace and fit."""
+                      doplot	True to generate overlay of trace and fit.
+                      njobs	Parallel processes for batch fits."""
         self.printVerbose(f"doFit(detname='{detname}', event={event},"
-                          f" channel={channel}, doplot={doplot})")
+                          f" channel={channel}, doplot={doplot},"
+                          f" njobs={njobs})")
+
+        # Lists of events or channels (from "-e 0-99" etc.) do a batch job
+        if not np.isscalar(event) or not np.isscalar(channel):
+            self.fitMany(detname, event, channel, doplot, njobs)
+            return
 
         if (channel<0):
             allChans = self.reader.channels(self.sensor)
@@ -136,6 +292,42 @@ class traceFitter:
 
         return
 
+    def fitMany(self, detname="", events=0, channels=0, doplot=False, njobs=1):
+        """Fit every combination of the specified events and channels,
+           reusing the open ROOT file (and any compiled fit kernels) across
+           the whole batch.  Arguments as doFit(), except that events and
+           channels may be lists of indices.
+
+           With njobs != 1 the independent fits are farmed out to worker
+           processes (-1 uses all cores); each worker opens the ROOT file
+           itself, since ROOT is process-safe but not thread-safe.  Fit
+           results may then be reported out of order."""
+        self.printVerbose(f"fitMany(detname='{detname}', events={events},"
+                          f" channels={channels}, doplot={doplot},"
+                          f" njobs={njobs})")
+
+        if np.isscalar(events):   events   = [events]
+        if np.isscalar(channels): channels = [channels]
+
+        tasks = [ (detname, int(ev), int(ch), doplot)
+                  for ev in events for ch in channels ]
+
+        if njobs != 1 and len(tasks) > 1:
+            if njobs < 0: njobs = os.cpu_count()
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=njobs,
+                                     initializer=_initWorker,
+                                     initargs=(self.reader.files, self.sensor,
+                                               self.verbose,
+                                               tuple(self.formats))) as pool:
+                list(pool.map(_fitWorker, tasks))
+            return
+
+        for task in tasks:
+            self.doFit(*task)
+
+        return
+
     def fitTES(self, detname="", event=0, channel=0, doplot=False):
         """Get specified TES trace (event and channel) from DMC file,
            fit for shape.  Arguments same as doFit().
@@ -154,8 +346,18 @@ class traceFitter:
         bins  = self.reader.timeBins("TES")
         trace = self.reader.TES(event, channel)
 
+        # Fitting passes are memory-bound; float32 halves the bytes touched
+        # and is ample for the ~1e-4 relative precision reported
+        bins  = bins.astype(np.float32, copy=False)
+        trace = trace.astype(np.float32, copy=False)
+
         #### Obtain figures of merit measurements for trace and template ####
-        results = self.fitTrace(bins, trace, self.TESshape, self.guessTES)
+        ipeak = int(trace.argmax())	# Single peak scan, shared below
+        peak  = trace[ipeak]
+        fitrange = self.fittingRange(trace, peak=peak, ipeak=ipeak)
+        results = self.fitTrace(bins, trace, self.TESshape, self.guessTES,
+                                self.TESjacobian, fitrange=fitrange,
+                                peak=peak, ipeak=ipeak)
 
         I0       = self.reader.TES_I0(event, channel)
         PhononE  = self.reader.getPhononE(event)[channel]
@@ -164,9 +366,10 @@ class traceFitter:
         results = np.append(results, I0);
         results = np.append(results, IversusE);
 
-        if doplot:
-            self.plots(detname, "TES", channel, bins, trace,
-                       self.TESshape(bins,*results))
+        if doplot:		# Only evaluate fitted shape where it's drawn
+            start, end = fitrange
+            fitshape = self.TESshape(bins[start:end], *results[:4])
+            self.plot(detname, channel, bins, trace, fitshape, fitrange)
 
         return results
 
@@ -179,18 +382,29 @@ class traceFitter:
         bins  = self.reader.timeBins("FET")
         trace = self.reader.FET(event, channel)
 
-        #### Obtain figures of merit measurements for trace and template ####
-        results = self.fitTrace(bins, trace, self.FETshape, self.guessFET, False)
+        # Fitting passes are memory-bound; float32 halves the bytes touched
+        # and is ample for the ~1e-4 relative precision reported
+        bins  = bins.astype(np.float32, copy=False)
+        trace = trace.astype(np.float32, copy=False)
 
-        ChargeQ = reader.getChargeQ(event)[channel]
+        #### Obtain figures of merit measurements for trace and template ####
+        ipeak = int(trace.argmax())	# Single peak scan, shared below
+        peak  = trace[ipeak]
+        fitrange = self.fittingRange(trace, peak=peak, ipeak=ipeak)
+        results = self.fitTrace(bins, trace, self.FETshape, self.guessFET,
+                                self.FETjacobian, fitrange=fitrange,
+                                peak=peak, ipeak=ipeak)
+
+        ChargeQ = self.reader.getChargeQ(event)[channel]
         Ceff    = ChargeQ*1.60218e-4 / results[0]  # (a, invTd, invTr, timeShift)
         # = Q/V, to get pF need 1e12 * coulomb/volt
 
         results = np.append(results, Ceff)
 
-        if doplot:
-            self.plots(detname, "FET", channel, bins, trace,
-                       self.FETshape(bins,*results))
+        if doplot:		# Only evaluate fitted shape where it's drawn
+            start, end = fitrange
+            fitshape = self.FETshape(bins[start:end], *results[:4])
+            self.plot(detname, channel, bins, trace, fitshape, fitrange)
 
         return results
 
@@ -239,8 +453,40 @@ class traceFitter:
         """Normalized, zero-aligned TES shape.  For internal use only."""
         if np.isscalar(t):
             return np.exp(-t/t_f)-np.exp(-t/t_r) if (t>=0) else 0.
-        else:
-            return np.array([cls._TESshape(ti,t_r,t_f) for ti in t])
+
+        if numexpr:		# Single fused pass instead of four temporaries
+            return numexpr.evaluate("where(t>=0., exp(-t/t_f)-exp(-t/t_r), 0.)")
+
+        tpos = np.where(t>=0., t, 0.)	# exp(0)-exp(0) gives 0 before t0
+        return np.exp(-tpos/t_f)-np.exp(-tpos/t_r)
+
+    @classmethod
+    def TESjacobian(cls, x, a, t_r, t_f, offset):
+        """Analytic Jacobian of TESshape w.r.t. (a, t_r, t_f, offset), as
+           (N,4) array for the least-squares fit.  Avoids finite-difference
+           estimation, which costs an extra shape evaluation per parameter
+           per step."""
+        t = x - offset
+        live = t >= 0.
+        tpos = np.where(live, t, 0.)	# Shape and derivatives zero before t0
+
+        ef = np.exp(-tpos/t_f)
+        er = np.exp(-tpos/t_r)
+        shape = ef - er			# Unnormalized shape (zero at tpos=0)
+
+        # Normalization is shape height at analytic peak position; its
+        # derivatives w.r.t. the time constants follow the envelope theorem
+        tpeak = np.log(t_f/t_r) * t_f*t_r / (t_f-t_r)
+        epf = np.exp(-tpeak/t_f)
+        epr = np.exp(-tpeak/t_r)
+        peak = epf - epr
+
+        dA   = shape/peak
+        dTr  = -(a/(peak*t_r**2)) * (er*tpos - shape*epr*tpeak/peak)
+        dTf  =  (a/(peak*t_f**2)) * (ef*tpos - shape*epf*tpeak/peak)
+        dOff =  (a/peak) * (ef/t_f - er/t_r) * live
+
+        return np.stack([dA, dTr, dTf, dOff], axis=-1)
 
     @classmethod
     def FETshape(cls, x, a, invTd, invTr, offset):
@@ -256,55 +502,95 @@ class traceFitter:
         if np.isscalar(t):
             shape = np.exp(-t*invTd)*invTd - np.exp(-t*invTr)*invTr
             return shape if (t>=0) else 0.
-        else:
-            return np.array([cls._FETshape(ti,invTd,invTr) for ti in t])
+
+        if numexpr:		# Single fused pass instead of four temporaries
+            return numexpr.evaluate("where(t>=0.,"
+                                    " exp(-t*invTd)*invTd - exp(-t*invTr)*invTr,"
+                                    " 0.)")
+
+        tpos = np.where(t>=0., t, 0.)
+        return (np.exp(-tpos*invTd)*invTd - np.exp(-tpos*invTr)*invTr)*(t>=0.)
+
+    @classmethod
+    def FETjacobian(cls, x, a, invTd, invTr, offset):
+        """Analytic Jacobian of FETshape w.r.t. (a, invTd, invTr, offset), as
+           (N,4) array for the least-squares fit.  Avoids finite-difference
+           estimation, which costs an extra shape evaluation per parameter
+           per step."""
+        t = x - offset
+        live = t >= 0.
+        tpos = np.where(live, t, 0.)	# Shape and derivatives zero before t0
+
+        ed = np.exp(-tpos*invTd)
+        er = np.exp(-tpos*invTr)
+        peak = invTr**2 - invTd**2
+        shape = (ed*invTd - er*invTr) * live	# Discontinuous at t=0
+
+        dA   = shape/peak
+        dTd  =  (a/peak)*ed*(1.-tpos*invTd)*live + (2.*a*invTd/peak**2)*shape
+        dTr  = -(a/peak)*er*(1.-tpos*invTr)*live - (2.*a*invTr/peak**2)*shape
+        dOff =  (a/peak) * (invTd**2*ed - invTr**2*er) * live
+
+        return np.stack([dA, dTd, dTr, dOff], axis=-1)
 
 
     # Fitting bounds and initial value estimates
 
-    def guessTES(self, bins, trace):
-        """Returns initial guesses for TES fit rise and fall time for curve_fit."""
-        peak = trace.max()
-        ipeak = trace.argmax()
+    def guessTES(self, bins, trace, peak=None, ipeak=None):
+        """Returns initial guesses for TES fit rise and fall time.  Callers
+           which already know the trace peak may pass it in to avoid a
+           second full-trace scan."""
+        if ipeak is None: ipeak = int(trace.argmax())
+        if peak is None: peak = trace[ipeak]
         self.printVerbose(f"guessTES: peak {peak} @ bin {ipeak} (t {bins[ipeak]})")
     
-        # Rise time: look for two e-foldings on rising side
-        rlo = np.nonzero(trace[:ipeak]<=0.1*peak)[0][-1]    # End of rising edge
-        rhi = np.nonzero(trace[:ipeak]<=0.2*peak*np.e)[0][-1]
+        # Rise time: look for two e-foldings on rising side; the running
+        # maximum is monotone, so a bisection search replaces the boolean
+        # masks and index arrays np.nonzero() would allocate
+        rising = np.maximum.accumulate(trace[:ipeak])
+        rlo = np.searchsorted(rising, 0.1*peak, side='right')-1  # End of rising edge
+        rhi = np.searchsorted(rising, 0.2*peak*np.e, side='right')-1
         riseGuess = (bins[rhi]-bins[rlo])
-    
-        # Fall time: look for two e-foldings on falling side
-        flo = np.nonzero(trace[ipeak:]<=0.8*peak)[0][0]     # Start of falling tail
-        fhi = np.nonzero(trace[ipeak:]<=0.4*peak/np.e)[0][0]
+
+        # Fall time: look for two e-foldings on falling side; running minimum
+        # first drops below each threshold exactly where the trace does
+        falling = np.minimum.accumulate(trace[ipeak:])
+        flo = np.searchsorted(-falling, -0.8*peak)          # Start of falling tail
+        fhi = np.searchsorted(-falling, -0.4*peak/np.e)
         fallGuess = (bins[fhi]-bins[flo])/2
 
-        # Analytic peak position is where d/dt of pulse shape is zero
-        # ==> t_peak = tR * ln[(tF+tR)/tR]
-        tpeak = riseGuess * np.log((fallGuess+riseGuess)/riseGuess)
+        # Analytic peak position is where d/dt of pulse shape is zero;
+        # same expression TESshape uses for its normalization
+        tpeak = (np.log(fallGuess/riseGuess)
+                 * fallGuess*riseGuess / (fallGuess-riseGuess))
         offsetGuess = bins[ipeak] - tpeak
-    
-        # Scale factor should be max of shape scaled by actual peak value
-        pmax = self.TESshape(tpeak, 1., riseGuess, fallGuess, 0.)
-        scaleGuess = peak / pmax
+
+        # TESshape is normalized so its maximum equals the scale parameter
+        scaleGuess = peak
 
         self.printVerbose(f"guessTES: scale {scaleGuess:.4e} rise {riseGuess:.4e},"
                           f" fall {fallGuess:.4e}, offset {offsetGuess:.4e} us")
     
         return scaleGuess, riseGuess, fallGuess, offsetGuess
 
-    def guessFET(self, bins, trace):
-        """Returns initial guesses for FET fit inverse decay and recovery times."""
-    
-        peak = trace.max()
-        ipeak = trace.argmax()
+    def guessFET(self, bins, trace, peak=None, ipeak=None):
+        """Returns initial guesses for FET fit inverse decay and recovery
+           times.  Callers which already know the trace peak may pass it in
+           to avoid a second full-trace scan."""
+        if ipeak is None: ipeak = int(trace.argmax())
+        if peak is None: peak = trace[ipeak]
         self.printVerbose(f"guessFET: peak {peak} @ bin {ipeak} (t {bins[ipeak]})")
 
-        # Peak should be at t=+binWidth (first bin after trigger)
-        istart = np.nonzero(bins>=0.)[0][0]+1
+        # Peak should be at t=+binWidth (first bin after trigger);
+        # bins are sorted, so bisection finds the t=0 crossing directly
+        istart = np.searchsorted(bins, 0.)+1
         offsetGuess = ipeak - istart
-    
-        # Decay time: look for second e-folding after the peak
-        dhi = np.nonzero(trace[ipeak:]>=peak/(2.*np.e))[0][-1]
+
+        # Decay time: look for second e-folding after the peak; the running
+        # maximum of the reversed tail is monotone, so bisection finds the
+        # last bin still above threshold without np.nonzero temporaries
+        tailmax = np.maximum.accumulate(trace[ipeak:][::-1])[::-1]
+        dhi = np.searchsorted(-tailmax, -peak/(2.*np.e), side='right')-1
         decayGuess = 2./(bins[dhi]-bins[0])
     
         # Recovery time; look for second e-folding beyond minimum
@@ -315,8 +601,11 @@ class traceFitter:
         recoveryGuess = 0.
         if tmin < 0:
             tlast = trace[imin:].max()
-            rlo = np.nonzero(trace[imin:]>=tmin*0.8)[0][0]
-            rhi = np.nonzero(trace[imin:]>=min(tmin*0.4/np.e,tlast))[0][0]
+            # Running maximum first reaches each threshold exactly where
+            # the recovering trace does; bisection replaces np.nonzero
+            recovering = np.maximum.accumulate(trace[imin:])
+            rlo = np.searchsorted(recovering, tmin*0.8)
+            rhi = np.searchsorted(recovering, min(tmin*0.4/np.e,tlast))
             recoveryGuess = 2./(bins[rhi]-bins[rlo])
             if recoveryGuess < 0.1*decayGuess:
                 self.printVerbose(f" recoveryGuess {recoveryGuess} not physical.")
@@ -331,45 +620,25 @@ class traceFitter:
         return scaleGuess, decayGuess, recoveryGuess, offsetGuess
 
 
-    def guessRange(self, guess=None):
-        """Compute allowed parameter ranges for fit based on initial guess
-           values."""
-        self.printVerbose(f"guessRange(guess={guess})")
-
-        if guess is None or guess==0.:
-            return (-np.inf, np.inf)
-
-        lower = 0.1*np.array(guess)
-        upper = 5.*np.array(guess)
-        bounds = (lower, upper)
-
-        for i,g in enumerate(guess):
-            if guess[i] == 0.:       	# Bounds can't both be zero!
-                bounds[0][i] = -np.inf
-                bounds[1][i] = np.inf
-            if guess[i] < 0.:		# Negative bounds need to be swapped
-                bounds[0][i],bounds[1][i] = bounds[1][i],bounds[0][i]
-
-        return bounds
-
-
-    def fittingRange(self, trace, cut=0.2):
+    def fittingRange(self, trace, cut=0.2, peak=None, ipeak=None):
         """Return starting and ending points for pulse fit, corresponding to
            'cut' height on either side of peak.  Assumes TES trace is flipped
-           and baseline-subtracted, or FET trace is charge-flipped."""
-        peak = max(trace)          # Peak Height
-        ipeak = trace.tolist().index(peak)
+           and baseline-subtracted, or FET trace is charge-flipped.  Callers
+           which already know the trace peak may pass it in to avoid a
+           second full-trace scan."""
+        if ipeak is None: ipeak = int(trace.argmax())
+        if peak is None: peak = trace[ipeak]        # Peak Height
         self.printVerbose(f"fittingRange: peak {peak} @ bin {ipeak}")
 
         ilo = 0
         ihi = len(trace)
     
         if self.sensor=="TES":
-            ilo = np.nonzero(trace[:ipeak]<=cut*peak)[0][-1]          # End of rising edge
-            ihi = ipeak+np.nonzero(trace[ipeak:]<=cut*peak)[0][0]     # Start of falling tail
+            ilo = _lastTrue(trace[:ipeak]<=cut*peak)                  # End of rising edge
+            ihi = ipeak+_firstTrue(trace[ipeak:]<=cut*peak)           # Start of falling tail
             self.printVerbose(f"fittingRange: TES I>{cut}*peak [{ilo}:{ihi}]")
         elif self.sensor=="FET":
-            ilo = trace.argmax()+1	# Start fit just after peak bin
+            ilo = ipeak+1		# Start fit just after peak bin
             ihi = ilo+2000		# TODO: Find far end after recovery
             self.printVerbose(f"fittingRange: FET [{ilo}:{ihi}]")
 
@@ -378,102 +647,203 @@ class traceFitter:
 
     ### General fitting function: sensor-specific info is in 'pulseShape' and 'guessFunc'
 
-    def fitTrace(self, bins, trace, pulseShape, guessFunc=None, dobounds=True):
+    def fitTrace(self, bins, trace, pulseShape, guessFunc=None, jacFunc=None,
+                 fitrange=None, peak=None, ipeak=None):
         """Fits input trace with binning to TES or FET shape; using function
-           for initial values
+           for initial values.  If jacFunc is provided, it supplies the
+           analytic Jacobian to least_squares instead of finite differences.
+           The (start,end) fitrange and trace peak may be passed in by
+           callers which have already computed them, avoiding extra
+           full-trace scans.
            Output: a      = scale factor from fit
                    t1     = rise time for TES, or decay rate for FET
                    t2     = fall time for TES, or recovery rate for FET
                    offset = t0 of best fit relative to t=0 bin
         """
         self.printVerbose(f"fitTrace(bins, trace, pulseShape={pulseShape},"
-                          f" guessFunc={guessFunc}, dobounds={dobounds})")
-    
-        start, end = self.fittingRange(trace)
+                          f" guessFunc={guessFunc}, jacFunc={jacFunc},"
+                          f" fitrange={fitrange})")
+
+        from scipy.optimize import least_squares	# Deferred, heavy import
+
+        if fitrange is None:
+            fitrange = self.fittingRange(trace, peak=peak, ipeak=ipeak)
+        start, end = fitrange
+
+        guess = guessFunc(bins, trace, peak, ipeak) if guessFunc else None
 
-        guess = guessFunc(bins, trace) if guessFunc else None
-        bounds = self.guessRange(guess) if dobounds else (-np.inf,np.inf)
-    
         self.printVerbose(f" range [{start}:{end}]\n guess {guess}")
-        if (dobounds): self.printVerbose(f"bounds {bounds}")
-                
-        params, _ = curve_fit(pulseShape, bins[start:end], trace[start:end],
-                              p0=guess, bounds=bounds)
+
+        # Levenberg-Marquardt doesn't support bounds; unconstrained LM is
+        # faster than the bound-handling 'trf' algorithm, and the initial
+        # guesses already start in the physical region.
+        x = bins[start:end]
+        y = trace[start:end]
+
+        kernel = {"TES": _TESresidJac, "FET": _FETresidJac}.get(self.sensor)
+        if kernel:		# JIT kernel does residuals+Jacobian in one pass
+            cache = {}		# least_squares calls resid and jac with same p
+            def evaluate(p):
+                key = p.tobytes()
+                if key not in cache:
+                    cache.clear()
+                    cache[key] = kernel(x, y, *p)
+                return cache[key]
+            resid = lambda p: evaluate(p)[0]
+            jac   = lambda p: evaluate(p)[1]
+        else:
+            resid = lambda p: pulseShape(x, *p) - y
+            jac = (lambda p: jacFunc(x, *p)) if jacFunc else '2-point'
+
+        result = least_squares(resid, guess, jac=jac, method='lm',
+                               x_scale='jac')
+        params = result.x
         self.printVerbose(f" final result {params}")
 
         return params
 
 
-    def plot(self, detname, channel, bins, trace, fitshape):
-        """Generate linear and log overlays of trace and fitted function."""
+    def plot(self, detname, channel, bins, trace, fitshape, fitrange):
+        """Generate linear and log overlays of trace and fitted function.
+           fitshape covers only the bins in fitrange=(start,end)."""
         self.printVerbose(f"plot(detname='{detname}', channel={channel},"
-                          f" bins, trace, fitshape)")
-    
+                          f" bins, trace, fitshape, fitrange={fitrange})")
+
         titleName = detname if detname else "Trace"
 
         template = self.template(detname, channel)
-    
-        self.overlay(titleName, bins, trace, fitshape, template)
-        plt.savefig(f"{titleName}-{self.sensor}_traceFit.eps", format='eps')
-        plt.savefig(f"{titleName}-{self.sensor}_traceFit.png")
+
+        fig = self.overlay(titleName, bins, trace, fitshape, template, fitrange)
+        for fmt in self.formats:
+            fig.savefig(f"{titleName}-{self.sensor}_traceFit.{fmt}", format=fmt)
+
+        # Figure is cached and reused by overlay(); deliberately not closed
 
     
-    def overlay(self, detname, bins, trace, fitshape, template):
+    def overlay(self, detname, bins, trace, fitshape, template, fitrange):
         """Plots TES or FET trace (log and linear) with specified binning, overlaid
-           with fitted shape and template detname argument used for plot title."""
+           with fitted shape and template detname argument used for plot title.
+           fitshape covers only the bins in fitrange=(start,end).  Returns
+           the figure, for the caller to save and close."""
         self.printVerbose(f"overlay(detname='{detname}', bins, trace,"
-                          f" fitshape, template)")
-    
-        units  = { "TES": "\mu A",
-                   "FET": "mV" }
-        xlim   = { "TES": [ [max(-100,bins.min()),min(3000,bins.max())],
-                            [max(-10,bins.min()),min(300,bins.max())] ],
-                   "FET": [ [max(-100,bins.min()),min(1000,bins.max())],
-                            [max(-10,bins.min()),min(300,bins.max())] ] }
-        yscale = { "TES": ["log","linear"],
-                   "FET": ["linear","linear"] }
-
-        start, end = self.fittingRange(trace)
-        fig, axes = plt.subplots(1, 2, figsize=(12*0.7, 4*0.7), dpi=200)
+                          f" fitshape, template, fitrange={fitrange})")
+
+        import matplotlib.pyplot as plt		# Deferred, heavy import
+
+        # Scan bins and trace once, outside the per-panel loop
+        bmin, bmax = float(bins.min()), float(bins.max())
+        xlim = { "TES": ( (max(-100,bmin), min(3000,bmax)),
+                          (max(-10,bmin),  min(300,bmax)) ),
+                 "FET": ( (max(-100,bmin), min(1000,bmax)),
+                          (max(-10,bmin),  min(300,bmax)) ) }[self.sensor]
+        yscale = self._yscale[self.sensor]
+        units  = self._units[self.sensor]
+
+        scaledTemplate = template*trace.max() if template is not None else None
+
+        # Simplify dense vector paths; full-trace lines are rasterized below,
+        # so vector formats (EPS) don't trace tens of thousands of segments
+        plt.rcParams['path.simplify'] = True
+        plt.rcParams['path.simplify_threshold'] = 1.0
+
+        start, end = fitrange
+        fig, axes = self._getFigure()
         for plot in range(2):
             currentAxis = axes.flatten()[plot]
 
-            if template is not None:
-                currentAxis.plot(bins,template*max(trace),lw=1,ls='--',
-                                 color='black', label='Template')
+            if scaledTemplate is not None:
+                currentAxis.plot(bins,scaledTemplate,lw=1,ls='--',
+                                 color='black', label='Template',
+                                 rasterized=True)
+
+            currentAxis.plot(bins, trace,lw=1,ls='-',color='red',label='Simulation',
+                             rasterized=True)
+            currentAxis.plot(bins[start:end], fitshape, label='Fit')
 
-            currentAxis.plot(bins, trace,lw=1,ls='-',color='red',label='Simulation')
-            currentAxis.plot(bins[start:end], fitshape[start:end], label='Fit')
-        
             currentAxis.set_xlabel(r"Time [$\mathrm{\mu s}$]")
-            currentAxis.set_ylabel(r"Amplitude [$\mathrm{"+units[self.sensor]+"}$]")
+            currentAxis.set_ylabel(r"Amplitude [$\mathrm{"+units+"}$]")
             currentAxis.legend()
-            currentAxis.set_xlim(xlim[self.sensor][plot])
-            currentAxis.set_yscale(yscale[self.sensor][plot])
+            currentAxis.set_xlim(xlim[plot])
+            currentAxis.set_yscale(yscale[plot])
 
         if detname: plt.title(detname)
         plt.tight_layout()
 
+        return fig
+
+
+    # Fixed per-sensor plot attributes, shared by overlay()
+    _units  = { "TES": "\mu A",
+                "FET": "mV" }
+    _yscale = { "TES": ["log","linear"],
+                "FET": ["linear","linear"] }
+
+    _figCache = {}	# Shared overlay figures, keyed on sensor type
+
+    def _getFigure(self):
+        """Return the shared overlay figure and axes for this sensor type,
+           creating them on first use.  Reusing one Figure across a batch
+           of fits avoids rebuilding the tick/text machinery every call;
+           the axes are cleared for redrawing instead."""
+        import matplotlib.pyplot as plt		# Deferred, heavy import
+
+        fig, axes = traceFitter._figCache.get(self.sensor, (None, None))
+
+        if fig is None or not plt.fignum_exists(fig.number):
+            fig, axes = plt.subplots(1, 2, figsize=(12*0.7, 4*0.7), dpi=200)
+            traceFitter._figCache[self.sensor] = (fig, axes)
+        else:
+            for ax in axes.flatten(): ax.clear()
+
+        return fig, axes
 
     def template(self, detname, chan):
-        """Extract channel template for specified detector, as Numpy array."""
+        """Extract channel template for specified detector, as Numpy array.
+           Parsed templates are cached, so looping over many events reads
+           each template file only once."""
         self.printVerbose(f"template(detname='{detname}', chan={chan})")
-    
-        if detname is None or detname == "": return None
-    
-        templatePath = f"{CDMS_SUPERSIM}/CDMSgeometry/data/dmc/{detname}/{self.sensor}Templates"
-        if not os.path.isfile(templatePath): return None
 
-        colname = {"TES":"Traces", "FET":"Trace"}[self.sensor]
-        templates = pd.read_csv(templatePath,sep="\t")
-        template = templates.loc[chan,colname].split()
-        template = np.array([float(i) for i in template])
+        if detname is None or detname == "": return None
 
-        self.printVerbose(f" got template from {templatePath} with"
-                          f" {len(template)} bins")
+        template = _readTemplate(detname, chan, self.sensor)
+        if template is not None:
+            self.printVerbose(f" got template for {detname} {self.sensor}"
+                              f" with {len(template)} bins")
         return template
 
 
+### PARALLEL BATCH WORKERS (module level so ProcessPoolExecutor can pickle) ###
+
+_workerFitter = None		# Per-process fitter, set up by _initWorker
+
+def _initWorker(files, sensor, verbose, formats=("png",)):
+    """Create the per-process traceFitter for parallel batch fits.  Open
+       ROOT files can't be pickled, so each worker opens its own."""
+    global _workerFitter
+    _workerFitter = traceFitter(files, sensor, verbose)
+    _workerFitter.setFormats(formats)
+
+def _fitWorker(task):
+    """Run one (detname, event, channel, doplot) fit in a worker process."""
+    _workerFitter.doFit(*task)
+
+
+### TEMPLATE FILE CACHE (module level so all fitters share it) ###
+
+@lru_cache(maxsize=64)
+def _readTemplate(detname, chan, sensor):
+    """Read and parse channel template file for specified detector, as
+       Numpy array.  Cached on (detname, chan, sensor) so a batch of many
+       events opens and parses each template file only once."""
+    templatePath = f"{CDMS_SUPERSIM}/CDMSgeometry/data/dmc/{detname}/{sensor}Templates"
+    if not os.path.isfile(templatePath): return None
+
+    colname = {"TES":"Traces", "FET":"Trace"}[sensor]
+    templates = pd.read_csv(templatePath,sep="\t")
+    template = templates.loc[chan,colname].split()
+    return np.array([float(i) for i in template])
+
+
 ### MAIN PROGRAM ###
 
 def main():
@@ -484,6 +854,7 @@ def main():
     fitter = traceFitter(**ctor)
 
     fitargs = { k:args[k] for k in args.keys()-ctor.keys() }
+    fitter.setFormats(fitargs.pop('formats'))
     fitter.doFit(**fitargs)
 
 def getargs():
@@ -493,13 +864,15 @@ def getargs():
                              'event':   <event number>, from -e>,
                              'channel': <channel number>, from -c>,
                              'sensor':  <sensor type>, from -s>,
+                             'njobs':   <parallel processes>, from -j>,
+                             'formats': <plot file formats>, from -f>,
                              'doplot':  <True|False>, from -p>,
                              'verbose': <True|False>, from -v>,
                            }
     """
     import getopt
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'c:d:e:s:hpv')
+        opts, args = getopt.getopt(sys.argv[1:], 'c:d:e:f:j:s:hpv')
     except getopt.GetoptError as err:
         sys.exit(2)
 
@@ -512,20 +885,26 @@ def getargs():
                 'event':   0,         # First event, first channel
                 'channel': 0,
                 'sensor':  "TES",     # TES or FET
+                'njobs':   1,         # Parallel processes for batch fits
+                'formats': "png",     # Plot file formats, comma-separated
                 'doplot':  False,     # Results only, no figures
                 'verbose': False,
                }
 
     for o,a in opts:
         if   o == '-c':
-            settings['channel'] = int(a)
+            settings['channel'] = parseIndices(a)
         elif o == '-d':
             settings['detname'] = a
         elif o == '-e':
-            settings['event'] = int(a)
+            settings['event'] = parseIndices(a)
+        elif o == '-f':
+            settings['formats'] = a
         elif o == '-h':
             usage()
             sys.exit(0)
+        elif o == '-j':
+            settings['njobs'] = int(a)
         elif o == '-p':
             settings['doplot'] = True
         elif o == '-s':
@@ -534,9 +913,27 @@ def getargs():
             settings['verbose'] = True
 
     if settings['verbose']: print(f"settings = {settings}")
-        
+
     return settings
 
+def parseIndices(arg):
+    """Convert command-line index string to int or list of ints, for batch
+       processing: '5' -> 5, '0-3' -> [0,1,2,3] (inclusive), '0,2,5' ->
+       [0,2,5].  Ranges and lists may be combined ('0-3,7').  A plain '-1'
+       keeps its special meaning (average or iterate)."""
+    if ',' in arg:
+        indices = []
+        for part in arg.split(','):
+            val = parseIndices(part)
+            indices += val if isinstance(val, list) else [val]
+        return indices
+
+    idash = arg.find('-', 1)	# Skip leading character to allow '-1'
+    if idash > 0:
+        return list(range(int(arg[:idash]), int(arg[idash+1:])+1))
+
+    return int(arg)
+
 
 ### COMMAND-LINE CALL ###
 
@@ -8,11 +8,14 @@
    20240120  Extracted functions from Jupyter notebooks
    20240202  Add support for non-signal traces (DataType)
    20241026  Add function to get dictionary of all traces in detector/event
+   20260901  Cache parsed templates in getTemplate for batch processing
+   20260901  Add getAllTraces, loading a whole file in one RDF event loop
 """
 
 import numpy as np
 import pandas as pd
 import ROOT
+from functools import lru_cache
 import os
 
 global CDMS_SUPERSIM
@@ -94,6 +97,29 @@ def getAllFET(file, event):
 
     return bins, traces, ChargeQ
 
+def getAllTraces(file, sensor, datatype=0):
+    """Extract every <sensor> trace of the given data type from the file
+       with a single RDF event loop.  Each per-(event,channel) call to
+       getTES/getFET re-runs the filters over the whole file, so batch
+       jobs should load once with this function and index the result.
+       Output: bins   = Numpy array of bin edges, shared by all traces
+               traces = Dict keyed on (event, channel) of raw trace arrays
+    """
+    printVerbose(f"getAllTraces(file='{file}', sensor={sensor},"
+                 f" datatype={datatype})")
+
+    branches = ['EventNum','ChanNum','Trace']
+    data = ROOT.RDataFrame(f"G4SimDir/g4dmc{sensor}", file, branches)\
+    .Filter(f"DataType=={datatype}").AsNumpy(branches)
+    convertRDFBranches(data)
+
+    bins = getBins(file, sensor, int(data['EventNum'][0]))
+
+    traces = { (int(ev),int(ch)): tr for ev,ch,tr in
+               zip(data['EventNum'],data['ChanNum'],data['Trace']) }
+
+    return bins, traces
+
 def getPlottableTraces(file, sensor, event):
     """Extract all <sensor> traces from specified file.  Returns three
        arrays/lists: channel names, time bins, and a transposed array
@@ -283,8 +309,11 @@ def getEventSums(file, event, branch):
     return eventSums[branch][0]     # Only one event in array of arrays
 
 
+@lru_cache(maxsize=64)
 def getTemplate(detname, chan, sensor):
-    """Extract channel template for specified detector, as Numpy array"""
+    """Extract channel template for specified detector, as Numpy array.
+       Cached on arguments, so batch loops over many events open and parse
+       each template file only once."""
     printVerbose(f"getTemplate(detname='{detname}', chan={chan}, sensor={sensor})")
     
     if detname is None or detname == "": return None